@@ -1,175 +1,121 @@
 from __future__ import annotations
 
-from typing import List
-
-from fastapi import APIRouter, Depends, status
-from fastapi import APIRouter, Depends, status, Body
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, status, Body, BackgroundTasks, Request
+from fastapi.responses import Response
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.deps import get_db
 from app.core.logging import get_logger
-from app.schemas.user import UserOut, UserCreate, UserUpdate, ChangePasswordRequest
+from app.schemas.user import UserOut, UserCreate, UserUpdate, ChangePasswordRequest, dump_users_json
 from app.services.http_client import OrientatiException
-from app.services.user_service import list_users, get_user, create_user, update_user, change_user_password, delete_user, \
+from app.services.user_service import list_users, get_user_json, create_user, update_user, change_user_password, delete_user, \
     request_email_verification, verify_email
 
 logger = get_logger(__name__)
 router = APIRouter()
 
 
-@router.get("/", response_model=List[UserOut])
-def api_list_users(limit: int = 50, offset: int = 0, db: Session = Depends(get_db)):
-    try:
-        return list_users(db, limit=limit, offset=offset)
-    except OrientatiException as e:
-        return JSONResponse(
-            status_code=e.status_code,
-            content={
-                "message": e.message,
-                "details": e.details,
-                "url": e.url
-            }
-        )
+def _json_response(content: bytes | str, status_code: int = status.HTTP_200_OK) -> Response:
+    # Le risposte vengono serializzate direttamente da pydantic-core: restituendo una Response
+    # FastAPI non rivalida l'output (response_model resta solo per la documentazione OpenAPI)
+    return Response(content=content, status_code=status_code, media_type="application/json")
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match usa il confronto debole (RFC 9110 §13.1.2): il prefisso W/ viene ignorato
+    if if_none_match.strip() == "*":
+        return True
+    opaque_tag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque_tag for tag in if_none_match.split(","))
+
+
+@router.get("/", response_model=list[UserOut])
+async def api_list_users(limit: int = 50, offset: int = 0, db: AsyncSession = Depends(get_db)):
+    return _json_response(dump_users_json(await list_users(db, limit=limit, offset=offset)))
 
 
 @router.get("/{user_id}", response_model=UserOut)
-async def api_get_user(user_id: int, db: Session = Depends(get_db)):
-    try:
-        user = get_user(db, user_id)
-        if not user:
-            raise OrientatiException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                message="Not Found",
-                details={"message": "User not found"},
-                url=f"users/{user_id}"
-            )
-        return user
-    except OrientatiException as e:
-        return JSONResponse(
-            status_code=e.status_code,
-            content={
-                "message": e.message,
-                "details": e.details,
-                "url": e.url
-            }
+async def api_get_user(user_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_user_json(db, user_id)
+    if not user:
+        raise OrientatiException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            message="Not Found",
+            details={"message": "User not found"},
+            url=f"users/{user_id}"
         )
+    headers = {"ETag": user.etag, "Cache-Control": "private, max-age=30"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response = _json_response(user.body)
+    response.headers.update(headers)
+    return response
 
 
 @router.post("/", response_model=UserOut, status_code=status.HTTP_201_CREATED)
-async def api_create_user(payload: UserCreate, db: Session = Depends(get_db)):
-    try:
-        return await create_user(db, payload)
-    except OrientatiException as e:
-        return JSONResponse(
-            status_code=e.status_code,
-            content={
-                "message": e.message,
-                "details": e.details,
-                "url": e.url
-            }
-        )
+async def api_create_user(payload: UserCreate, background_tasks: BackgroundTasks,
+                          db: AsyncSession = Depends(get_db)):
+    user = await create_user(db, payload, background_tasks)
+    return _json_response(user.model_dump_json(), status.HTTP_201_CREATED)
 
 
 @router.patch("/{user_id}", response_model=UserOut)
-async def api_update_user(user_id: int, payload: UserUpdate, db: Session = Depends(get_db)):
-    try:
-        user = await update_user(db, user_id, payload)
-        if not user:
-            raise OrientatiException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                message="Not Found",
-                details={"message": "User not found"},
-                url=f"users/{user_id}"
-            )
-        return user
-    except OrientatiException as e:
-        return JSONResponse(
-            status_code=e.status_code,
-            content={
-                "message": e.message,
-                "details": e.details,
-                "url": e.url
-            }
+async def api_update_user(user_id: int, payload: UserUpdate, background_tasks: BackgroundTasks,
+                          db: AsyncSession = Depends(get_db)):
+    user = await update_user(db, user_id, payload, background_tasks)
+    if not user:
+        raise OrientatiException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            message="Not Found",
+            details={"message": "User not found"},
+            url=f"users/{user_id}"
         )
+    return _json_response(user.model_dump_json())
 
 
 @router.post("/change_password", status_code=status.HTTP_204_NO_CONTENT)
 async def api_change_password(
         payload: ChangePasswordRequest,
-        db: Session = Depends(get_db)
+        background_tasks: BackgroundTasks,
+        db: AsyncSession = Depends(get_db)
 ):
-    try:
-        success = await change_user_password(db, payload.user_id, payload.old_password, payload.new_password)
-        if not success:
-            raise OrientatiException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                message="Bad Request",
-                details={"message": "Password change failed"},
-                url="users/change_password"
-            )
-    except OrientatiException as e:
-        return JSONResponse(
-            status_code=e.status_code,
-            content={
-                "message": e.message,
-                "details": e.details,
-                "url": e.url
-            }
+    success = await change_user_password(db, payload.user_id, payload.old_password, payload.new_password,
+                                         background_tasks)
+    if not success:
+        raise OrientatiException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            message="Bad Request",
+            details={"message": "Password change failed"},
+            url="users/change_password"
         )
 
 
 @router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def api_delete_user(user_id: int, db: Session = Depends(get_db)):
-    try:
-        success = await delete_user(db, user_id)
-        if not success:
-            raise OrientatiException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                message="Not Found",
-                details={"message": "User not found"},
-                url=f"users/{user_id}"
-            )
-    except OrientatiException as e:
-        return JSONResponse(
-            status_code=e.status_code,
-            content={
-                "message": e.message,
-                "details": e.details,
-                "url": e.url
-            }
+async def api_delete_user(user_id: int, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_db)):
+    success = await delete_user(db, user_id, background_tasks)
+    if not success:
+        raise OrientatiException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            message="Not Found",
+            details={"message": "User not found"},
+            url=f"users/{user_id}"
         )
 
 
 @router.post("/request_email_verification", status_code=status.HTTP_204_NO_CONTENT)
 async def api_request_email_verification(
+        background_tasks: BackgroundTasks,
         user_id: int = Body(..., embed=True),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ):
-    try:
-        await request_email_verification(user_id, db)
-    except OrientatiException as e:
-        return JSONResponse(
-            status_code=e.status_code,
-            content={
-                "message": e.message,
-                "details": e.details,
-                "url": e.url
-            }
-        )
+    await request_email_verification(user_id, db, background_tasks)
 
 
 @router.post("/verify_email", status_code=status.HTTP_204_NO_CONTENT)
-async def api_verify_email(token: str = Body(..., embed=True)):
-    try:
-        await verify_email(token)
-    except OrientatiException as e:
-        return JSONResponse(
-            status_code=e.status_code,
-            content={
-                "message": e.message,
-                "details": e.details,
-                "url": e.url
-            }
-        )
+async def api_verify_email(
+        background_tasks: BackgroundTasks,
+        token: str = Body(..., embed=True),
+        db: AsyncSession = Depends(get_db)
+):
+    await verify_email(db, token, background_tasks)
@@ -15,6 +15,10 @@ class Settings(BaseSettings):
     SENTRY_RELEASE: str = "0.1.0"
     API_PREFIX: str = "/api/v1"
     SERVER_URL: str = "example.com"
+    REDIS_URL: str = "redis://localhost:6379/0"
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_SOCKET_CONNECT_TIMEOUT: float = 0.05  # secondi: la cache è opzionale, non deve bloccare le richieste
+    REDIS_SOCKET_TIMEOUT: float = 0.05
 
     model_config = SettingsConfigDict(
         env_file=".env",
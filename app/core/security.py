@@ -0,0 +1,33 @@
+import hmac
+import os
+
+import anyio
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+
+# Argon2id con i parametri raccomandati da argon2-cffi (RFC 9106, profilo low-memory)
+_password_hasher = PasswordHasher()
+
+# Ogni hash Argon2 alloca 64 MiB (memory_cost=65536 KiB): i thread che eseguono hash_password/verify_password
+# sono limitati a circa uno per CPU invece dei 40 del limiter di default di anyio, condiviso con le route sync
+PASSWORD_HASH_LIMITER = anyio.CapacityLimiter(os.cpu_count() or 1)
+
+
+def hash_password(password: str) -> str:
+    """Calcola l'hash Argon2 della password. CPU-bound: dal codice async va eseguita in un thread con PASSWORD_HASH_LIMITER."""
+    return _password_hasher.hash(password)
+
+
+def verify_password(hashed_password: str, password: str) -> bool:
+    """Verifica la password contro l'hash Argon2.
+    CPU-bound: dal codice async va eseguita in un thread con PASSWORD_HASH_LIMITER.
+
+    Gli utenti creati prima dell'introduzione di Argon2 hanno la password salvata in chiaro:
+    in quel caso il confronto avviene in tempo costante con hmac.compare_digest.
+    """
+    try:
+        return _password_hasher.verify(hashed_password, password)
+    except VerificationError:
+        return False
+    except InvalidHashError:
+        return hmac.compare_digest(hashed_password.encode("utf-8"), password.encode("utf-8"))
@@ -0,0 +1,43 @@
+"""indice token verifica email
+
+Revision ID: 8e2d4c7b1f05
+Revises: 5b1e0f3a9c42
+Create Date: 2026-10-15 10:48:27.902114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e2d4c7b1f05'
+down_revision: Union[str, Sequence[str], None] = '5b1e0f3a9c42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CREATE INDEX CONCURRENTLY non può essere eseguito dentro una transazione
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_users_verify_email_token',
+            'users',
+            ['verify_email_token'],
+            unique=True,
+            postgresql_where=sa.text('verify_email_token IS NOT NULL'),
+            postgresql_concurrently=True,
+            sqlite_where=sa.text('verify_email_token IS NOT NULL'),
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_users_verify_email_token',
+            table_name='users',
+            postgresql_concurrently=True,
+        )
@@ -1,13 +1,38 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
 from app.core.config import settings
 
-# Engine e Session (SQLAlchemy 2.x, modalità sincrona)
-engine = create_engine(settings.DATABASE_URL,
-   pool_size=1000,  # connessioni permanenti
-   max_overflow=2000,  # connessioni extra temporanee
-   pool_timeout=5,  # secondi prima di dare errore se pool pieno
-   pool_recycle=1800,  # ricrea connessioni vecchie ogni 30 minuti
-   pool_pre_ping=True,  # verifica connessione prima di riutilizzarla
+# Driver asincroni da usare al posto di quelli sincroni (alembic continua a usare DATABASE_URL così com'è)
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+
+def get_async_database_url(url: str) -> str:
+    """Converte l'URL del database nella variante con driver asincrono."""
+    parsed = make_url(url)
+    drivername = ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername)
+    return parsed.set(drivername=drivername).render_as_string(hide_password=False)
+
+
+# Engine e Session (SQLAlchemy 2.x, modalità asincrona)
+engine = create_async_engine(
+    get_async_database_url(settings.DATABASE_URL),
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=20,  # connessioni permanenti
+    max_overflow=10,  # connessioni extra temporanee
+    pool_timeout=30,  # secondi prima di dare errore se pool pieno
+    pool_recycle=3600,  # ricrea connessioni vecchie ogni ora
+    pool_pre_ping=True,  # verifica connessione prima di riutilizzarla
+)
+SessionLocal = async_sessionmaker(
+    bind=engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False,  # evita lazy-load impliciti (non ammessi in async) dopo il commit
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
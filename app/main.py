@@ -5,10 +5,14 @@ from contextlib import asynccontextmanager
 import sentry_sdk
 from fastapi import FastAPI, Request
 from fastapi.responses import ORJSONResponse
+from sqlalchemy import text
 
 from app.api.v1.routes import users
 from app.core.config import settings
-from app.core.logging import setup_logging
+from app.core.logging import setup_logging, get_logger
+from app.db.session import engine
+from app.services.broker import AsyncBrokerSingleton
+from app.services.cache import init_cache, close_cache
 from app.services.http_client import OrientatiException
 
 sentry_sdk.init(
@@ -18,10 +22,30 @@ sentry_sdk.init(
 )
 
 
+logger = get_logger(__name__)
+
+
+async def warmup_db_pool():
+    """Apre una connessione al DB all'avvio, così la prima richiesta non paga l'handshake."""
+    try:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    except Exception as e:
+        logger.warning(f"Database warm-up failed: {e}")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     setup_logging()
+    await warmup_db_pool()
+    await init_cache()
+    app.state.broker = AsyncBrokerSingleton()
+    await app.state.broker.connect()
+    app.state.broker.start_publisher()
     yield
+    await app.state.broker.close()
+    await close_cache()
+    await engine.dispose()
 
 
 app = FastAPI(
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from datetime import datetime
 
-from sqlalchemy import String, DateTime, Integer, func, Boolean
+from sqlalchemy import String, DateTime, Integer, func, Boolean, Index, text
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.db.base import Base
@@ -12,7 +12,7 @@ class User(Base):
     __tablename__ = "users"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
-    email: Mapped[str] = mapped_column(String(255), index=True)
+    email: Mapped[str] = mapped_column(String(255), index=True, unique=True)
     email_verified: Mapped[bool] = mapped_column(Boolean, index=False, default=False)
     name: Mapped[str] = mapped_column(String(255), index=True)
     surname: Mapped[str] = mapped_column(String(255), index=True)
@@ -25,3 +25,17 @@ class User(Base):
     updated_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False
     )
+
+    # created_at/updated_at generati dal DB vengono riletti con INSERT/UPDATE ... RETURNING (niente refresh)
+    __mapper_args__ = {"eager_defaults": True}
+
+    __table_args__ = (
+        # indice parziale: contiene solo gli utenti con una verifica email in sospeso
+        Index(
+            "ix_users_verify_email_token",
+            "verify_email_token",
+            unique=True,
+            postgresql_where=text("verify_email_token IS NOT NULL"),
+            sqlite_where=text("verify_email_token IS NOT NULL"),
+        ),
+    )
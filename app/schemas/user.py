@@ -1,8 +1,9 @@
 from __future__ import annotations
 
 from datetime import datetime
+from typing import NamedTuple, TypedDict
 
-from pydantic import BaseModel, EmailStr, ConfigDict
+from pydantic import BaseModel, EmailStr, ConfigDict, TypeAdapter
 
 
 class UserBase(BaseModel):
@@ -12,7 +13,7 @@ class UserBase(BaseModel):
 
 
 class UserCreate(UserBase):
-    hashed_password: str
+    password: str
 
 
 class UserUpdate(BaseModel):
@@ -32,6 +33,37 @@ class UserOut(UserBase):
     )
 
 
+class UserJson(NamedTuple):
+    """Utente già serializzato per GET /users/{user_id}: ETag e corpo JSON della risposta."""
+    etag: str
+    body: bytes
+
+
+def user_etag(user: UserOut) -> str:
+    # ETag debole: cambia a ogni modifica dell'utente (updated_at è aggiornato dal DB)
+    return f'W/"{user.id}-{int(user.updated_at.timestamp() * 1_000_000)}"'
+
+
+class UserOutRow(TypedDict):
+    """Riga di users con le sole colonne esposte da UserOut (vedi list_users)."""
+    id: int
+    email: str
+    email_verified: bool
+    name: str
+    surname: str
+    created_at: datetime
+    updated_at: datetime
+
+
+# Adapter costruito una sola volta all'import e riutilizzato da tutte le richieste
+USER_OUT_LIST = TypeAdapter(list[UserOutRow])
+
+
+def dump_users_json(users: list[UserOutRow]) -> bytes:
+    """Serializza le righe in JSON direttamente con pydantic-core, senza validarle."""
+    return USER_OUT_LIST.dump_json(users)
+
+
 class ChangePasswordRequest(BaseModel):
     user_id: int
     old_password: str
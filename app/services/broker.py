@@ -1,15 +1,19 @@
 from __future__ import annotations
 
-import json
 import asyncio
 import uuid
 import aio_pika
+import msgspec
 
 from app.core.config import settings
 from app.core.logging import get_logger, setup_logging
 
 logger = get_logger(__name__)
 
+PUBLISH_QUEUE_SIZE = 1000  # messaggi in attesa oltre i quali enqueue_message attende (backpressure)
+PUBLISH_BATCH_SIZE = 100  # massimo numero di messaggi pubblicati insieme
+PUBLISH_BATCH_WAIT = 0.005  # secondi di attesa per riempire un batch dopo il primo messaggio
+
 
 class AsyncBrokerSingleton:
     """Singleton asincrono per la gestione della connessione a RabbitMQ e delle operazioni di publish/subscribe."""
@@ -37,14 +41,23 @@ class AsyncBrokerSingleton:
             self.service_name = service_name
             self.connection = None
             self.channel = None
+            self.exchanges = {}
             self.queues = {}
             self.consumer_tags = {}
+            self.publish_queue = None
+            self.publisher_task = None
+            self.publisher_stopped = False
             self.initialized = True
 
+    @property
+    def is_connected(self) -> bool:
+        """Indica se la connessione e il canale verso RabbitMQ sono aperti."""
+        return bool(self.connection and not self.connection.is_closed and self.channel and not self.channel.is_closed)
+
     async def connect(self):
-        """Stabilisce una connessione asincrona a RabbitMQ."""
+        """Stabilisce una connessione asincrona a RabbitMQ. Se già connesso non fa nulla."""
         try:
-            if self.connection and not self.connection.is_closed:
+            if self.is_connected:
                 return True
 
             self.connection = await aio_pika.connect_robust(
@@ -54,6 +67,7 @@ class AsyncBrokerSingleton:
                 password=settings.RABBITMQ_PASS
             )
             self.channel = await self.connection.channel()
+            self.exchanges = {}
             logger.info("Connected to RabbitMQ (aio-pika)")
 
             return True
@@ -110,16 +124,16 @@ class AsyncBrokerSingleton:
         Args:
             exchange_name (str): Nome dell'exchange su cui pubblicare il messaggio.
             msg_type (str): Tipo di messaggio.
-            data (dict): Dati del messaggio.
+            data (dict | msgspec.Struct): Dati del messaggio.
             routing_key (str): Chiave di routing per il messaggio (default: ""). Se vuota, il messaggio viene inviato a tutti i consumatori dell'exchange.
         """
-        exchange = await self.channel.declare_exchange(exchange_name, "direct", durable=True)
+        exchange = await self._get_exchange(exchange_name)
         message = aio_pika.Message(
-            body=json.dumps({
+            body=msgspec.json.encode({
                 "id": str(uuid.uuid4()),
                 "type": msg_type,
                 "data": data
-            }).encode("utf-8"),
+            }),
             content_type="application/json",
             delivery_mode=aio_pika.DeliveryMode.PERSISTENT
         )
@@ -127,14 +141,111 @@ class AsyncBrokerSingleton:
         logger.info(
             f"Sent message to exchange {exchange_name}. Type: {msg_type}, Routing key: {routing_key} (aio-pika)")
 
+    async def _get_exchange(self, exchange_name):
+        """Restituisce l'exchange dichiarato sul canale condiviso, dichiarandolo solo al primo utilizzo.
+
+        Args:
+            exchange_name (str): Nome dell'exchange.
+        """
+        exchange = self.exchanges.get(exchange_name)
+        if exchange is None:
+            exchange = await self.channel.declare_exchange(exchange_name, "direct", durable=True)
+            self.exchanges[exchange_name] = exchange
+        return exchange
+
+    def start_publisher(self):
+        """Avvia il task che pubblica in batch i messaggi accodati con enqueue_message."""
+        if self.publisher_task is None:
+            self.publish_queue = asyncio.Queue(maxsize=PUBLISH_QUEUE_SIZE)
+            self.publisher_task = asyncio.create_task(self._publisher_worker())
+            self.publisher_stopped = False
+
+    async def stop_publisher(self, timeout: float = 5.0):
+        """Attende lo svuotamento della coda di pubblicazione (al massimo timeout secondi) e ferma il task."""
+        if self.publisher_task is None:
+            return
+        try:
+            await asyncio.wait_for(self.publish_queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dropping {self.publish_queue.qsize()} unpublished messages on shutdown")
+        self.publisher_task.cancel()
+        try:
+            await self.publisher_task
+        except asyncio.CancelledError:
+            pass
+        self.publisher_task = None
+        self.publish_queue = None
+        self.publisher_stopped = True
+
+    async def enqueue_message(self, exchange_name, msg_type, data, routing_key=""):
+        """Accoda un messaggio da pubblicare (stessi argomenti di publish_message).
+        Se il publisher non è mai stato avviato il messaggio viene pubblicato subito;
+        se è già stato fermato (shutdown) il messaggio viene scartato.
+        """
+        if self.publisher_stopped:
+            logger.warning(f"Broker publisher stopped, dropping message to exchange {exchange_name}. Type: {msg_type}")
+            return
+        if self.publisher_task is None:
+            if await self.connect():
+                await self.publish_message(exchange_name, msg_type, data, routing_key=routing_key)
+            else:
+                logger.warning("Could not connect to broker.")
+            return
+        await self.publish_queue.put((exchange_name, msg_type, data, routing_key))
+
+    async def _collect_batch(self):
+        """Attende il primo messaggio in coda e raccoglie i successivi fino a PUBLISH_BATCH_SIZE
+        o allo scadere di PUBLISH_BATCH_WAIT."""
+        loop = asyncio.get_running_loop()
+        batch = [await self.publish_queue.get()]
+        deadline = loop.time() + PUBLISH_BATCH_WAIT
+        while len(batch) < PUBLISH_BATCH_SIZE:
+            if not self.publish_queue.empty():
+                batch.append(self.publish_queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.publish_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _publish_batch(self, batch):
+        """Pubblica insieme i messaggi del batch, sovrapponendo le conferme del broker sul canale condiviso."""
+        if not await self.connect():
+            logger.warning(f"Could not connect to broker, dropping {len(batch)} messages.")
+            return
+        results = await asyncio.gather(
+            *(self.publish_message(exchange_name, msg_type, data, routing_key=routing_key)
+              for exchange_name, msg_type, data, routing_key in batch),
+            return_exceptions=True
+        )
+        for (exchange_name, msg_type, _, _), result in zip(batch, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error publishing message to exchange {exchange_name}. Type: {msg_type}: {result}")
+
+    async def _publisher_worker(self):
+        """Pubblica in batch i messaggi accodati con enqueue_message."""
+        while True:
+            batch = await self._collect_batch()
+            try:
+                await self._publish_batch(batch)
+            finally:
+                for _ in batch:
+                    self.publish_queue.task_done()
+
     async def close(self):
         """Chiude la connessione a RabbitMQ e annulla tutte le sottoscrizioni (asincrono)."""
+        await self.stop_publisher()
         for queue_name in list(self.consumer_tags.keys()):
             await self.unsubscribe(queue_name)
         if self.channel:
             await self.channel.close()
         if self.connection:
             await self.connection.close()
+        self.exchanges = {}
         logger.info("Closed all RabbitMQ consumer tasks (aio-pika)")
 
 
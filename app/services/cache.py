@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+from redis.asyncio import ConnectionPool, Redis
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.schemas.user import UserJson
+
+logger = get_logger(__name__)
+
+USER_CACHE_TTL = 300  # secondi
+USER_CACHE_KEY = "user:{user_id}"
+# Se la DELETE di invalidazione fallisce (es. timeout di 50 ms sotto carico) la voce obsoleta resterebbe
+# servita, e confermata con 304 dall'ETag, fino alla scadenza del TTL. Si è scelto di ritentare la DELETE
+# una volta invece di accorciare il TTL: il costo è solo sul percorso di scrittura e l'hit rate non cambia.
+# Se anche il secondo tentativo fallisce l'errore viene loggato e la voce scade dopo USER_CACHE_TTL.
+INVALIDATE_ATTEMPTS = 2
+
+_redis: Redis | None = None
+
+
+async def init_cache() -> None:
+    """Crea il client Redis condiviso (da chiamare nel lifespan dell'app)."""
+    global _redis
+    pool = ConnectionPool.from_url(
+        settings.REDIS_URL,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+    )
+    _redis = Redis(connection_pool=pool)
+    logger.info("Redis cache initialized")
+
+
+async def close_cache() -> None:
+    """Chiude il client Redis e il relativo pool di connessioni."""
+    global _redis
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
+
+
+async def get_user_cached(user_id: int) -> UserJson | None:
+    """Restituisce ETag e JSON dell'utente dalla cache, oppure None se assente o se la cache non è disponibile.
+    I byte sono scritti da questo servizio: vengono restituiti così come sono, senza rivalidarli."""
+    if _redis is None:
+        return None
+    try:
+        raw = await _redis.get(USER_CACHE_KEY.format(user_id=user_id))
+    except Exception as e:
+        logger.warning(f"Error reading user {user_id} from cache: {e}")
+        return None
+    if raw is None:
+        return None
+    # valore salvato: ETag, "\n", corpo JSON (il JSON serializzato non contiene a capo)
+    etag, sep, body = raw.partition(b"\n")
+    if not sep:
+        return None  # voce nel vecchio formato (solo JSON): trattata come miss e riscritta
+    return UserJson(etag.decode(), body)
+
+
+async def set_user_cached(user_id: int, user: UserJson) -> None:
+    """Salva ETag e JSON dell'utente in cache con scadenza USER_CACHE_TTL."""
+    if _redis is None:
+        return
+    try:
+        await _redis.setex(USER_CACHE_KEY.format(user_id=user_id), USER_CACHE_TTL, user.etag.encode() + b"\n" + user.body)
+    except Exception as e:
+        logger.warning(f"Error caching user {user_id}: {e}")
+
+
+async def invalidate_user(user_id: int) -> None:
+    """Rimuove l'utente dalla cache (da chiamare dopo ogni modifica), con al massimo INVALIDATE_ATTEMPTS tentativi."""
+    if _redis is None:
+        return
+    key = USER_CACHE_KEY.format(user_id=user_id)
+    for attempt in range(1, INVALIDATE_ATTEMPTS + 1):
+        try:
+            await _redis.delete(key)
+            return
+        except Exception as e:
+            logger.warning(f"Error invalidating cached user {user_id} (attempt {attempt}/{INVALIDATE_ATTEMPTS}): {e}")
+    logger.error(f"Cached user {user_id} not invalidated, stale for up to {USER_CACHE_TTL} seconds")
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import msgspec
+
+from app.models.user import User
+from app.schemas.user import UserOut
+
+
+class UserEvent(msgspec.Struct):
+    """Payload pubblicato sull'exchange "users" per le operazioni CREATE/UPDATE."""
+    id: int
+    email: str
+    email_verified: bool
+    name: str
+    surname: str
+    hashed_password: str
+    created_at: str
+    updated_at: str
+
+    @classmethod
+    def from_user(cls, user: User) -> UserEvent:
+        return cls(
+            id=user.id,
+            email=user.email,
+            email_verified=user.email_verified,
+            name=user.name,
+            surname=user.surname,
+            hashed_password=user.hashed_password,
+            created_at=user.created_at.isoformat(),
+            updated_at=user.updated_at.isoformat(),
+        )
+
+    @classmethod
+    def from_user_out(cls, user_out: UserOut, hashed_password: str) -> UserEvent:
+        """Costruisce l'evento dall'utente già serializzato per la risposta HTTP."""
+        return cls(
+            id=user_out.id,
+            email=user_out.email,
+            email_verified=user_out.email_verified,
+            name=user_out.name,
+            surname=user_out.surname,
+            hashed_password=hashed_password,
+            created_at=user_out.created_at.isoformat(),
+            updated_at=user_out.updated_at.isoformat(),
+        )
+
+
+class UserDeletedEvent(msgspec.Struct):
+    """Payload pubblicato sull'exchange "users" per l'operazione DELETE."""
+    id: int
@@ -3,17 +3,21 @@ from __future__ import annotations
 import secrets
 from datetime import datetime, timedelta, timezone
 from enum import Enum
-from typing import Iterable
 
-from sqlalchemy import select
-from sqlalchemy.orm import Session
+import anyio
+from fastapi import BackgroundTasks
+from sqlalchemy import select, update, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.api.deps import get_db
 from app.core.config import settings
 from app.core.logging import get_logger
+from app.core.security import hash_password, verify_password, PASSWORD_HASH_LIMITER
 from app.models.user import User
-from app.schemas.user import UserCreate, UserUpdate
+from app.schemas.user import UserCreate, UserUpdate, UserOut, UserOutRow, UserJson, user_etag
 from app.services.broker import AsyncBrokerSingleton
+from app.services.cache import get_user_cached, set_user_cached, invalidate_user
+from app.services.events import UserEvent, UserDeletedEvent
 from app.services.http_client import OrientatiException
 
 logger = get_logger(__name__)
@@ -22,6 +26,16 @@ RABBIT_DELETE_TYPE = "DELETE"
 RABBIT_UPDATE_TYPE = "UPDATE"
 RABBIT_CREATE_TYPE = "CREATE"
 
+USER_OUT_COLUMNS = (
+    User.id,
+    User.email,
+    User.email_verified,
+    User.name,
+    User.surname,
+    User.created_at,
+    User.updated_at,
+)
+
 
 class UserCreateErrorType(Enum):
     INVALID_EMAIL = "invalid_email"
@@ -30,17 +44,24 @@ class UserCreateErrorType(Enum):
 
 
 class UserCreateError(OrientatiException):
-    def __init__(self, message: str, error_type: str = "default_error"):
+    def __init__(self, message: str, error_type: str = "default_error", url: str = "/users/create"):
         super().__init__("Bad Request", 400, {
             "message": message,
             "type": error_type
-        }, "/users/create")
+        }, url)
+
 
+def _is_email_taken(e: IntegrityError) -> bool:
+    """Indica se la violazione riguarda l'indice UNIQUE su users.email (Postgres / SQLite)."""
+    message = str(e.orig)
+    return "ix_users_email" in message or "UNIQUE constraint failed: users.email" in message
 
-def list_users(db: Session, limit: int = 50, offset: int = 0) -> Iterable[User]:
+
+async def list_users(db: AsyncSession, limit: int = 50, offset: int = 0) -> list[UserOutRow]:
     try:
-        stmt = select(User).limit(limit).offset(offset)
-        return db.execute(stmt).scalars().all()
+        # solo le colonne esposte da UserOut: hashed_password e token non escono dal DB
+        stmt = select(*USER_OUT_COLUMNS).limit(limit).offset(offset)
+        return [dict(row) for row in (await db.execute(stmt)).mappings()]
     except Exception as e:
         raise OrientatiException(
             exc=e,
@@ -48,32 +69,53 @@ def list_users(db: Session, limit: int = 50, offset: int = 0) -> Iterable[User]:
         )
 
 
-def get_user(db: Session, user_id: int) -> User | None:
-    return db.get(User, user_id)
+async def get_user(db: AsyncSession, user_id: int) -> User | None:
+    return await db.get(User, user_id)
 
 
-async def create_user(db: Session, payload: UserCreate) -> User:
+async def get_user_json(db: AsyncSession, user_id: int) -> UserJson | None:
+    """
+    Restituisce l'utente già serializzato in JSON con il suo ETag, leggendolo dalla cache Redis se presente (cache-aside)
+    :param db:
+    :param user_id:
+    :return: ETag e corpo della risposta, o None se l'utente non esiste
+    """
+    cached = await get_user_cached(user_id)
+    if cached is not None:
+        return cached
+    user = await get_user(db, user_id)
+    if not user:
+        return None
+    user_out = UserOut.model_validate(user)
+    user_json = UserJson(user_etag(user_out), user_out.model_dump_json().encode())
+    await set_user_cached(user_id, user_json)
+    return user_json
+
+
+async def create_user(db: AsyncSession, payload: UserCreate, background_tasks: BackgroundTasks) -> UserOut:
     try:
-        existing_user = db.query(User).filter_by(email=payload.email).first()
-        if existing_user:
+        # il formato dell'email è già validato da EmailStr in UserCreate
+        hashed_password = await anyio.to_thread.run_sync(hash_password, payload.password, limiter=PASSWORD_HASH_LIMITER)
+        user = User(**payload.model_dump(exclude={"password"}), hashed_password=hashed_password)
+        # il token di verifica viene salvato con la stessa INSERT
+        email_request = _new_verification_email(user)
+        db.add(user)
+        try:
+            await db.commit()
+        except IntegrityError as e:
+            # l'unicità dell'email è garantita dall'indice UNIQUE su users.email
+            await db.rollback()
+            if not _is_email_taken(e):
+                raise
             raise UserCreateError(
                 message="Email already in use",
                 error_type=UserCreateErrorType.EMAIL_TAKEN.value,
             )
-
-        if not payload.email or "@" not in payload.email:
-            raise UserCreateError(
-                message="Invalid email format",
-                error_type=UserCreateErrorType.INVALID_EMAIL.value,
-            )
-
-        user = User(**payload.model_dump())
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-        await update_services(user, RABBIT_CREATE_TYPE)
-        await send_verification_email(user)
-        return user
+        user_out = UserOut.model_validate(user)
+        background_tasks.add_task(update_services, user, RABBIT_CREATE_TYPE, user_out)
+        background_tasks.add_task(AsyncBrokerSingleton().enqueue_message, "email", "email_notification", email_request,
+                                  routing_key="send_email")
+        return user_out
     except UserCreateError as e:
         raise e
     except Exception as e:
@@ -83,22 +125,40 @@ async def create_user(db: Session, payload: UserCreate) -> User:
         )
 
 
-async def update_user(db: Session, user_id: int, payload: UserUpdate) -> User | None:
+async def update_user(db: AsyncSession, user_id: int, payload: UserUpdate,
+                      background_tasks: BackgroundTasks) -> UserOut | None:
     try:
-        user = db.get(User, user_id)
-        if not user:
-            raise OrientatiException(
-                status_code=404,
-                message="Not Found",
-                details={"message": "User not found"},
-                url=f"users/{user_id}"
+        values = payload.model_dump(exclude_unset=True)
+        try:
+            if values:
+                # UPDATE ... RETURNING: aggiorna e rilegge l'utente in un solo round-trip.
+                # populate_existing: se l'utente è già nella session i valori restituiti sovrascrivono quelli vecchi
+                stmt = update(User).where(User.id == user_id).values(**values).returning(User)
+                user = (await db.execute(stmt, execution_options={"synchronize_session": False,
+                                                                  "populate_existing": True})).scalar_one_or_none()
+            else:
+                user = await db.get(User, user_id)
+            if not user:
+                raise OrientatiException(
+                    status_code=404,
+                    message="Not Found",
+                    details={"message": "User not found"},
+                    url=f"users/{user_id}"
+                )
+            await db.commit()
+        except IntegrityError as e:
+            await db.rollback()
+            if not _is_email_taken(e):
+                raise
+            raise UserCreateError(
+                message="Email already in use",
+                error_type=UserCreateErrorType.EMAIL_TAKEN.value,
+                url=f"users/{user_id}",
             )
-        for field, value in payload.model_dump(exclude_unset=True).items():
-            setattr(user, field, value)
-        db.commit()
-        db.refresh(user)
-        await update_services(user, RABBIT_UPDATE_TYPE)
-        return user
+        await invalidate_user(user_id)
+        user_out = UserOut.model_validate(user)
+        background_tasks.add_task(update_services, user, RABBIT_UPDATE_TYPE, user_out)
+        return user_out
     except OrientatiException as e:
         raise e
     except Exception as e:
@@ -108,15 +168,17 @@ async def update_user(db: Session, user_id: int, payload: UserUpdate) -> User |
         )
 
 
-async def change_user_password(db: Session, user_id: int, old_password: str, new_password: str) -> bool:
+async def change_user_password(db: AsyncSession, user_id: int, old_password: str, new_password: str,
+                               background_tasks: BackgroundTasks) -> bool:
     try:
-        user = db.get(User, user_id)
-        if not user or user.hashed_password != old_password:
+        user = await db.get(User, user_id)
+        if not user or not await anyio.to_thread.run_sync(verify_password, user.hashed_password, old_password,
+                                                          limiter=PASSWORD_HASH_LIMITER):
             return False
-        user.hashed_password = new_password
-        db.commit()
-        db.refresh(user)
-        await update_services(user, RABBIT_UPDATE_TYPE)
+        user.hashed_password = await anyio.to_thread.run_sync(hash_password, new_password, limiter=PASSWORD_HASH_LIMITER)
+        await db.commit()
+        await invalidate_user(user_id)
+        background_tasks.add_task(update_services, user, RABBIT_UPDATE_TYPE)
         return True
     except Exception as e:
         raise OrientatiException(
@@ -125,14 +187,15 @@ async def change_user_password(db: Session, user_id: int, old_password: str, new
         )
 
 
-async def delete_user(db: Session, user_id: int) -> bool:
+async def delete_user(db: AsyncSession, user_id: int, background_tasks: BackgroundTasks) -> bool:
     try:
-        user = db.get(User, user_id)
+        user = await db.get(User, user_id)
         if not user:
             return False
-        db.delete(user)
-        db.commit()
-        await update_services(user, RABBIT_DELETE_TYPE)
+        await db.delete(user)
+        await db.commit()
+        await invalidate_user(user_id)
+        background_tasks.add_task(update_services, user, RABBIT_DELETE_TYPE)
         return True
     except Exception as e:
         raise OrientatiException(
@@ -141,64 +204,65 @@ async def delete_user(db: Session, user_id: int) -> bool:
         )
 
 
-async def update_services(user: User, operation: str):
+async def update_services(user: User, operation: str, user_out: UserOut | None = None):
+    """
+    Notifica agli altri servizi la modifica dell'utente
+    :param user:
+    :param operation: tipo di operazione (RABBIT_CREATE_TYPE, RABBIT_UPDATE_TYPE, RABBIT_DELETE_TYPE)
+    :param user_out: utente già serializzato per la risposta, se disponibile viene riusato per il messaggio
+    """
     try:
-        broker_instance = AsyncBrokerSingleton()
-        connected = await broker_instance.connect()
-        if connected:
-            message = {
-                "id": user.id,
-                "email": user.email,
-                "email_verified": user.email_verified,
-                "name": user.name,
-                "surname": user.surname,
-                "hashed_password": user.hashed_password,
-                "created_at": str(user.created_at),
-                "updated_at": str(user.updated_at)
-            } if operation != RABBIT_DELETE_TYPE else {"id": user.id}
-            await broker_instance.publish_message("users", operation, message)
+        if operation == RABBIT_DELETE_TYPE:
+            message = UserDeletedEvent(id=user.id)
+        elif user_out is not None:
+            message = UserEvent.from_user_out(user_out, user.hashed_password)
         else:
-            logger.warning("Could not connect to broker.")
+            message = UserEvent.from_user(user)
+        # il messaggio viene pubblicato in batch dal publisher del broker avviato nel lifespan
+        await AsyncBrokerSingleton().enqueue_message("users", operation, message)
     except Exception as e:
         logger.error(f"Error updating services for user {user.id}. Operation: {operation}: {e}")
         raise e
 
 
-async def send_verification_email(user: User):
+def _new_verification_email(user: User) -> dict:
+    """
+    Assegna all'utente un nuovo token di verifica (senza salvarlo) e prepara la richiesta di invio email
+    :param user:
+    :return: richiesta email da pubblicare sull'exchange "email"
+    """
+    token = secrets.token_urlsafe(32)
+    user.email_verified = False  # TODO: considerare se controllare se è già verificato
+    user.verify_email_token = token
+    user.verify_email_token_expiration = datetime.now(timezone.utc) + timedelta(minutes=30)
+    return {
+        "to": user.email,
+        "subject": "Verifica il tuo Account Orientati",
+        "template_name": "verify_email_v1",
+        "context": {
+            "username": f"{user.surname} {user.name}",
+            "link": f"https://{settings.SERVER_URL}/api/v1/users/verify_email?token={token}"
+        }
+    }
+
+
+async def send_verification_email(db: AsyncSession, user: User, background_tasks: BackgroundTasks):
     try:
-        broker_instance = AsyncBrokerSingleton()
-        connected = await broker_instance.connect()
-        if connected:
-            token = secrets.token_urlsafe(32)
-            email_request = {
-                "to": user.email,
-                "subject": "Verifica il tuo Account Orientati",
-                "template_name": "verify_email_v1",
-                "context": {
-                    "username": f"{user.surname} {user.name}",
-                    "link": f"https://{settings.SERVER_URL}/api/v1/users/verify_email?token={token}"
-                }
-            }
-
-            db = next(get_db())
-            db_user = db.query(User).filter(User.id == user.id).first()
-            db_user.email_verified = False  # TODO: considerare se controllare se è già verificato
-            db_user.verify_email_token = token
-            db_user.verify_email_token_expiration = datetime.now() + timedelta(minutes=30)
-            db.commit()
-            await update_services(db_user, RABBIT_UPDATE_TYPE)
-            await broker_instance.publish_message("email", "email_notification", email_request,
-                                                  routing_key="send_email")
-        else:
-            logger.warning("Could not connect to broker.")
+        email_request = _new_verification_email(user)
+        await db.commit()
+        await invalidate_user(user.id)
+        # la pubblicazione avviene dopo l'invio della risposta
+        background_tasks.add_task(update_services, user, RABBIT_UPDATE_TYPE)
+        background_tasks.add_task(AsyncBrokerSingleton().enqueue_message, "email", "email_notification", email_request,
+                                  routing_key="send_email")
     except Exception as e:
         logger.error(f"Error sending verification email for user {user.id}: {e}")
         raise e
 
 
-async def request_email_verification(user_id: int, db: Session):
+async def request_email_verification(user_id: int, db: AsyncSession, background_tasks: BackgroundTasks):
     try:
-        user = get_user(db, user_id)
+        user = await get_user(db, user_id)
         if not user:
             raise OrientatiException(
                 status_code=404,
@@ -206,7 +270,7 @@ async def request_email_verification(user_id: int, db: Session):
                 details={"message": "User not found"},
                 url=f"users/{user_id}/request_email_verification"
             )
-        await send_verification_email(user)
+        await send_verification_email(db, user, background_tasks)
     except OrientatiException as e:
         raise e
     except Exception as e:
@@ -216,36 +280,34 @@ async def request_email_verification(user_id: int, db: Session):
         )
 
 
-async def verify_email(token: str):
+async def verify_email(db: AsyncSession, token: str, background_tasks: BackgroundTasks):
     """
     Verifica l'email dell'utente tramite il token passato
+    :param db:
     :param token:
+    :param background_tasks: task in cui accodare la notifica agli altri servizi
     :return: stato verifica
     """
     try:
-        db = next(get_db())
-        user = db.query(User).filter(User.verify_email_token == token).first()
+        # unico UPDATE ... RETURNING: ricerca del token, controllo scadenza e verifica in modo atomico
+        stmt = (
+            update(User)
+            .where(User.verify_email_token == token, User.verify_email_token_expiration > func.now())
+            .values(email_verified=True, verify_email_token=None, verify_email_token_expiration=None)
+            .returning(User)
+        )
+        user = (await db.execute(stmt, execution_options={"synchronize_session": False,
+                                                          "populate_existing": True})).scalar_one_or_none()
         if not user:
             raise OrientatiException(
                 status_code=404,
                 message="Not Found",
-                details={"message": "Invalid verification token"},
-                url="users/verify_email"
-            )
-
-        if user.verify_email_token_expiration < datetime.now(timezone.utc):
-            raise OrientatiException(
-                status_code=400,
-                message="Bad Request",
-                details={"message": "Verification token has expired"},
+                details={"message": "Invalid or expired verification token"},
                 url="users/verify_email"
             )
-        user.email_verified = True
-        user.verify_email_token = None
-        user.verify_email_token_expiration = None
-        db.commit()
-        db.refresh(user)
-        await update_services(user, RABBIT_UPDATE_TYPE)
+        await db.commit()
+        await invalidate_user(user.id)
+        background_tasks.add_task(update_services, user, RABBIT_UPDATE_TYPE)
         return True
     except OrientatiException as e:
         raise e
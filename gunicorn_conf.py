@@ -0,0 +1,22 @@
+import os
+
+from uvicorn.workers import UvicornWorker
+
+# Configurazione gunicorn per l'avvio in produzione:
+#   gunicorn -c gunicorn_conf.py app.main:app
+# Stessi parametri del comando uvicorn del Dockerfile (porta, worker, backlog, keep-alive, limit-concurrency).
+
+
+class UsersServiceWorker(UvicornWorker):
+    # uvloop e httptools (installati con uvicorn[standard]) al posto di asyncio e h11;
+    # limit_concurrency non è esposto dalle impostazioni di gunicorn
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools", "limit_concurrency": 1000}
+
+
+bind = f"0.0.0.0:{os.getenv('USERS_SERVICE_PORT', '8000')}"
+worker_class = UsersServiceWorker
+# ogni worker ha il proprio pool di connessioni al DB (fino a 30): dimensionare rispetto a max_connections di Postgres
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+backlog = 4096
+keepalive = 30  # secondi di keep-alive HTTP (timeout_keep_alive di uvicorn)
+graceful_timeout = 30
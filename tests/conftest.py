@@ -1,29 +1,50 @@
 import pytest
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, clear_mappers
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import StaticPool
 
+from app.api.deps import get_db
 from app.db.base import Base
-from app.models.user import User
+from app.main import app
+from app.models.user import User  # noqa: F401
 
 # Database in-memory per test
-TEST_DATABASE_URL = "sqlite+pysqlite:///:memory:"
+TEST_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
 
-@pytest.fixture(scope="session")
-def engine():
-    engine = create_engine(TEST_DATABASE_URL, connect_args={"check_same_thread": False})
-    Base.metadata.create_all(engine)
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def engine():
+    """Database nuovo per ogni test: i servizi fanno commit, quindi non basta il rollback"""
+    engine = create_async_engine(TEST_DATABASE_URL, poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
     yield engine
-    Base.metadata.drop_all(engine)
+    await engine.dispose()
 
 
-@pytest.fixture(scope="function")
-def db_session(engine):
+@pytest.fixture
+async def db_session(engine):
     """Session di test isolata per ogni test"""
-    connection = engine.connect()
-    transaction = connection.begin()
-    Session = sessionmaker(bind=connection)
-    session = Session()
-    yield session
-    session.close()
-    transaction.rollback()
-    connection.close()
+    SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    async with SessionLocal() as session:
+        yield session
+
+
+@pytest.fixture
+async def client(db_session):
+    """Client HTTP sull'app con get_db sostituito dalla session di test.
+    Senza lifespan la cache Redis non è inizializzata: le letture vanno sempre al DB"""
+    async def override_get_db():
+        yield db_session
+
+    app.dependency_overrides[get_db] = override_get_db
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            yield client
+    finally:
+        app.dependency_overrides.clear()
@@ -0,0 +1,69 @@
+import pytest
+
+from app.services import broker as broker_module
+from app.services.broker import AsyncBrokerSingleton
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    """Broker senza RabbitMQ: connect e publish_message registrano le chiamate invece di usare la rete"""
+    instance = AsyncBrokerSingleton()
+    published = []
+    batches = []
+    connects = []
+
+    async def fake_connect():
+        connects.append(True)
+        return True
+
+    async def fake_publish_message(exchange_name, msg_type, data, routing_key=""):
+        published.append((exchange_name, msg_type, data, routing_key))
+
+    original_publish_batch = instance._publish_batch
+
+    async def recording_publish_batch(batch):
+        batches.append(len(batch))
+        await original_publish_batch(batch)
+
+    # monkeypatch ripristina anche lo stato del singleton a fine test
+    monkeypatch.setattr(instance, "connect", fake_connect)
+    monkeypatch.setattr(instance, "publish_message", fake_publish_message)
+    monkeypatch.setattr(instance, "_publish_batch", recording_publish_batch)
+    monkeypatch.setattr(instance, "publish_queue", None)
+    monkeypatch.setattr(instance, "publisher_task", None)
+    monkeypatch.setattr(instance, "publisher_stopped", False)
+    instance.published = published
+    instance.batches = batches
+    instance.connects = connects
+    yield instance
+    for name in ("published", "batches", "connects"):
+        delattr(instance, name)
+
+
+@pytest.mark.anyio
+async def test_enqueue_message_publishes_in_batches(broker):
+    broker.start_publisher()
+    total = 2 * broker_module.PUBLISH_BATCH_SIZE + 50
+    for i in range(total):
+        await broker.enqueue_message("users", "UPDATE", {"id": i})
+    await broker.stop_publisher()
+
+    assert [data["id"] for _, _, data, _ in broker.published] == list(range(total))
+    assert broker.batches == [broker_module.PUBLISH_BATCH_SIZE, broker_module.PUBLISH_BATCH_SIZE, 50]
+    assert len(broker.connects) == len(broker.batches)
+
+
+@pytest.mark.anyio
+async def test_enqueue_message_after_stop_is_dropped(broker):
+    broker.start_publisher()
+    await broker.stop_publisher()
+
+    await broker.enqueue_message("users", "UPDATE", {"id": 1})
+    assert broker.published == []
+    assert broker.connects == []
+
+
+@pytest.mark.anyio
+async def test_enqueue_message_without_publisher_publishes_directly(broker):
+    await broker.enqueue_message("email", "email_notification", {"to": "a@gaga.com"}, routing_key="send_email")
+    assert broker.published == [("email", "email_notification", {"to": "a@gaga.com"}, "send_email")]
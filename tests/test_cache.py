@@ -0,0 +1,162 @@
+import json
+
+import pytest
+from fastapi import BackgroundTasks
+from redis.exceptions import TimeoutError as RedisTimeoutError
+from sqlalchemy import delete
+
+from app.models.user import User
+from app.schemas.user import UserCreate, UserUpdate
+from app.services import cache
+from app.services.user_service import create_user, get_user, get_user_json, update_user, change_user_password
+from app.services.user_service import delete_user, request_email_verification, verify_email
+
+
+class FakeRedis:
+    """Redis in memoria con i soli comandi usati da app.services.cache; failures simula i timeout"""
+
+    def __init__(self):
+        self.store = {}
+        self.ttls = {}
+        self.failures = {}  # comando -> numero di errori da sollevare
+
+    def _maybe_fail(self, command):
+        if self.failures.get(command, 0):
+            self.failures[command] -= 1
+            raise RedisTimeoutError(f"{command} timed out")
+
+    async def get(self, key):
+        self._maybe_fail("get")
+        return self.store.get(key)
+
+    async def setex(self, key, ttl, value):
+        self._maybe_fail("setex")
+        self.store[key] = value
+        self.ttls[key] = ttl
+
+    async def delete(self, key):
+        self._maybe_fail("delete")
+        self.store.pop(key, None)
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(cache, "_redis", fake)
+    return fake
+
+
+async def _cached_user(db_session, fake_redis, email="cache@gaga.com"):
+    user = await create_user(db_session, UserCreate(password="pass", email=email, name="C", surname="U"),
+                             BackgroundTasks())
+    await get_user_json(db_session, user.id)
+    assert f"user:{user.id}" in fake_redis.store
+    return user
+
+
+@pytest.mark.anyio
+async def test_get_user_json_miss_then_hit(db_session, fake_redis):
+    user = await create_user(db_session, UserCreate(password="pass", email="hit@gaga.com", name="H", surname="I"),
+                             BackgroundTasks())
+    key = f"user:{user.id}"
+
+    # miss: letto dal DB e salvato in cache come ETag + "\n" + JSON
+    first = await get_user_json(db_session, user.id)
+    assert fake_redis.store[key] == first.etag.encode() + b"\n" + first.body
+    assert fake_redis.ttls[key] == cache.USER_CACHE_TTL
+    assert json.loads(first.body)["email"] == "hit@gaga.com"
+
+    # hit: l'utente non è più nel DB ma viene servito dalla cache, byte per byte
+    await db_session.execute(delete(User).where(User.id == user.id))
+    await db_session.commit()
+    assert await get_user_json(db_session, user.id) == first
+
+
+@pytest.mark.anyio
+async def test_get_user_json_old_format_is_a_miss(db_session, fake_redis):
+    user = await create_user(db_session, UserCreate(password="pass", email="old@gaga.com", name="O", surname="F"),
+                             BackgroundTasks())
+    fake_redis.store[f"user:{user.id}"] = b'{"id": 1}'
+
+    result = await get_user_json(db_session, user.id)
+    assert json.loads(result.body)["email"] == "old@gaga.com"
+    assert fake_redis.store[f"user:{user.id}"].startswith(result.etag.encode() + b"\n")
+
+
+@pytest.mark.anyio
+async def test_update_user_invalidates_cache(db_session, fake_redis):
+    user = await _cached_user(db_session, fake_redis)
+    await update_user(db_session, user.id, UserUpdate(name="new"), BackgroundTasks())
+    assert f"user:{user.id}" not in fake_redis.store
+
+
+@pytest.mark.anyio
+async def test_change_password_invalidates_cache(db_session, fake_redis):
+    user = await _cached_user(db_session, fake_redis)
+    assert await change_user_password(db_session, user.id, "pass", "newpass", BackgroundTasks()) is True
+    assert f"user:{user.id}" not in fake_redis.store
+
+
+@pytest.mark.anyio
+async def test_delete_user_invalidates_cache(db_session, fake_redis):
+    user = await _cached_user(db_session, fake_redis)
+    assert await delete_user(db_session, user.id, BackgroundTasks()) is True
+    assert f"user:{user.id}" not in fake_redis.store
+
+
+@pytest.mark.anyio
+async def test_request_email_verification_invalidates_cache(db_session, fake_redis):
+    user = await _cached_user(db_session, fake_redis)
+    await request_email_verification(user.id, db_session, BackgroundTasks())
+    assert f"user:{user.id}" not in fake_redis.store
+
+
+@pytest.mark.anyio
+async def test_verify_email_invalidates_cache(db_session, fake_redis):
+    user = await _cached_user(db_session, fake_redis)
+    token = (await get_user(db_session, user.id)).verify_email_token
+    assert await verify_email(db_session, token, BackgroundTasks()) is True
+    assert f"user:{user.id}" not in fake_redis.store
+
+
+@pytest.mark.anyio
+async def test_get_error_falls_back_to_db(db_session, fake_redis):
+    user = await create_user(db_session, UserCreate(password="pass", email="get@gaga.com", name="G", surname="E"),
+                             BackgroundTasks())
+    fake_redis.failures["get"] = 1
+
+    result = await get_user_json(db_session, user.id)
+    assert json.loads(result.body)["email"] == "get@gaga.com"
+
+
+@pytest.mark.anyio
+async def test_setex_error_falls_back_to_db(db_session, fake_redis):
+    user = await create_user(db_session, UserCreate(password="pass", email="setex@gaga.com", name="S", surname="E"),
+                             BackgroundTasks())
+    fake_redis.failures["setex"] = 1
+
+    result = await get_user_json(db_session, user.id)
+    assert json.loads(result.body)["email"] == "setex@gaga.com"
+    assert f"user:{user.id}" not in fake_redis.store
+
+
+@pytest.mark.anyio
+async def test_delete_error_is_retried(db_session, fake_redis):
+    user = await _cached_user(db_session, fake_redis)
+    fake_redis.failures["delete"] = 1
+
+    await update_user(db_session, user.id, UserUpdate(name="retry"), BackgroundTasks())
+    assert f"user:{user.id}" not in fake_redis.store
+
+
+@pytest.mark.anyio
+async def test_delete_error_does_not_fail_the_write(db_session, fake_redis):
+    user = await _cached_user(db_session, fake_redis)
+    fake_redis.failures["delete"] = cache.INVALIDATE_ATTEMPTS
+
+    updated = await update_user(db_session, user.id, UserUpdate(name="committed"), BackgroundTasks())
+    assert updated.name == "committed"
+    # la voce obsoleta resta fino alla scadenza del TTL
+    assert f"user:{user.id}" in fake_redis.store
+    db_session.expire_all()
+    assert (await get_user(db_session, user.id)).name == "committed"
@@ -0,0 +1,126 @@
+import json
+import uuid
+from datetime import datetime, timezone
+
+import aio_pika
+import msgspec
+import pytest
+from fastapi import BackgroundTasks
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+
+from app.models.user import User
+from app.schemas.user import UserCreate, UserUpdate, UserOut
+from app.services.broker import AsyncBrokerSingleton
+from app.services.events import UserEvent, UserDeletedEvent
+from app.services.user_service import create_user, get_user, update_user
+
+CREATED_AT = datetime(2025, 1, 2, 3, 4, 5, 123456, tzinfo=timezone.utc)
+UPDATED_AT = datetime(2025, 6, 7, 8, 9, 10, tzinfo=timezone.utc)
+
+# payload atteso dai servizi che consumano l'exchange "users": timestamp in isoformat() (separatore "T")
+USER_EVENT_DATA = {
+    "id": 7,
+    "email": "event@gaga.com",
+    "email_verified": True,
+    "name": "Ev",
+    "surname": "Ent",
+    "hashed_password": "$argon2id$hash",
+    "created_at": "2025-01-02T03:04:05.123456+00:00",
+    "updated_at": "2025-06-07T08:09:10+00:00",
+}
+
+
+class FakeExchange:
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, message, routing_key=""):
+        self.published.append((message, routing_key))
+
+
+@pytest.fixture
+def exchange(monkeypatch):
+    """Exchange finto restituito da _get_exchange: raccoglie i messaggi pubblicati da publish_message"""
+    fake = FakeExchange()
+
+    async def fake_get_exchange(exchange_name):
+        return fake
+
+    monkeypatch.setattr(AsyncBrokerSingleton(), "_get_exchange", fake_get_exchange)
+    return fake
+
+
+def _user():
+    return User(id=7, email="event@gaga.com", email_verified=True, name="Ev", surname="Ent",
+                hashed_password="$argon2id$hash", created_at=CREATED_AT, updated_at=UPDATED_AT)
+
+
+async def _publish(exchange, msg_type, data):
+    await AsyncBrokerSingleton().publish_message("users", msg_type, data)
+    message, routing_key = exchange.published[-1]
+    assert routing_key == ""
+    assert message.content_type == "application/json"
+    assert message.delivery_mode == aio_pika.DeliveryMode.PERSISTENT
+    envelope = json.loads(message.body)
+    assert set(envelope) == {"id", "type", "data"}
+    uuid.UUID(envelope["id"])
+    assert envelope["type"] == msg_type
+    return envelope["data"]
+
+
+@pytest.mark.anyio
+async def test_create_envelope_from_user(exchange):
+    assert await _publish(exchange, "CREATE", UserEvent.from_user(_user())) == USER_EVENT_DATA
+
+
+@pytest.mark.anyio
+async def test_update_envelope_from_user_out(exchange):
+    user = _user()
+    event = UserEvent.from_user_out(UserOut.model_validate(user), user.hashed_password)
+    assert await _publish(exchange, "UPDATE", event) == USER_EVENT_DATA
+
+
+@pytest.mark.anyio
+async def test_delete_envelope(exchange):
+    assert await _publish(exchange, "DELETE", UserDeletedEvent(id=7)) == {"id": 7}
+
+
+def _expected_event(user_out, hashed_password):
+    data = user_out.model_dump()
+    data.update(
+        hashed_password=hashed_password,
+        created_at=user_out.created_at.isoformat(),
+        updated_at=user_out.updated_at.isoformat(),
+    )
+    return data
+
+
+@pytest.mark.anyio
+async def test_update_services_events_match_user_out(engine, monkeypatch):
+    enqueued = []
+
+    async def fake_enqueue_message(exchange_name, msg_type, data, routing_key=""):
+        enqueued.append((exchange_name, msg_type, data))
+
+    monkeypatch.setattr(AsyncBrokerSingleton(), "enqueue_message", fake_enqueue_message)
+    SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+    create_tasks = BackgroundTasks()
+    update_tasks = BackgroundTasks()
+    async with SessionLocal() as session:
+        created = await create_user(session, UserCreate(password="pass", email="bg@gaga.com", name="B", surname="G"),
+                                    create_tasks)
+        updated = await update_user(session, created.id, UserUpdate(name="Bg"), update_tasks)
+        hashed_password = (await get_user(session, created.id)).hashed_password
+
+    # i task girano dopo l'invio della risposta, a session già chiusa
+    await create_tasks()
+    await update_tasks()
+
+    users_events = [(msg_type, data) for exchange_name, msg_type, data in enqueued if exchange_name == "users"]
+    assert [msg_type for msg_type, _ in users_events] == ["CREATE", "UPDATE"]
+    for (_, event), user_out in zip(users_events, (created, updated)):
+        assert isinstance(event, UserEvent)
+        assert msgspec.structs.asdict(event) == _expected_event(user_out, hashed_password)
+    assert updated.name == users_events[1][1].name == "Bg"
+    assert [msg_type for exchange_name, msg_type, _ in enqueued if exchange_name == "email"] == ["email_notification"]
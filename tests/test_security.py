@@ -0,0 +1,49 @@
+import pytest
+from fastapi import BackgroundTasks
+
+from app.core.security import hash_password, verify_password, PASSWORD_HASH_LIMITER
+from app.schemas.user import UserCreate
+from app.services import user_service
+
+
+def test_hash_password_round_trip():
+    hashed = hash_password("secret")
+    assert hashed != "secret"
+    assert hashed.startswith("$argon2id$")
+    assert verify_password(hashed, "secret") is True
+    assert verify_password(hashed, "wrong") is False
+
+
+def test_hash_password_salted():
+    # ogni hash usa un salt diverso
+    assert hash_password("secret") != hash_password("secret")
+
+
+def test_verify_password_plaintext_fallback():
+    # utenti creati prima di Argon2: password salvata in chiaro
+    assert verify_password("legacy-pass", "legacy-pass") is True
+    assert verify_password("legacy-pass", "wrong") is False
+
+
+@pytest.mark.anyio
+async def test_password_hashing_uses_limiter(db_session, monkeypatch):
+    # hash_password/verify_password girano nei thread di PASSWORD_HASH_LIMITER, non in quelli di default di anyio
+    borrowed = []
+
+    def recording_hash_password(password):
+        borrowed.append(("hash", PASSWORD_HASH_LIMITER.borrowed_tokens))
+        return hash_password(password)
+
+    def recording_verify_password(hashed_password, password):
+        borrowed.append(("verify", PASSWORD_HASH_LIMITER.borrowed_tokens))
+        return verify_password(hashed_password, password)
+
+    monkeypatch.setattr(user_service, "hash_password", recording_hash_password)
+    monkeypatch.setattr(user_service, "verify_password", recording_verify_password)
+
+    user = await user_service.create_user(
+        db_session, UserCreate(password="pass", email="limiter@gaga.com", name="L", surname="M"), BackgroundTasks())
+    assert await user_service.change_user_password(db_session, user.id, "pass", "newpass", BackgroundTasks()) is True
+
+    assert borrowed == [("hash", 1), ("verify", 1), ("hash", 1)]
+    assert PASSWORD_HASH_LIMITER.borrowed_tokens == 0
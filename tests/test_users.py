@@ -1,154 +1,188 @@
+import re
+from datetime import datetime, timedelta, timezone
+
 import pytest
+from fastapi import BackgroundTasks
 from pydantic import ValidationError
 
 from app.schemas.user import UserCreate
 from app.schemas.user import UserUpdate
 from app.services.user_service import create_user, get_user, list_users
-from app.services.user_service import update_user
-from app.services.http_client import HttpClientException
+from app.services.user_service import update_user, verify_email
+from app.services.http_client import OrientatiException
 
 
-def test_create_user_success(db_session):
+@pytest.mark.anyio
+async def test_create_user_success(db_session):
     payload = UserCreate(
-        username="admin",
-        hashed_password="admin",
+        password="admin",
         email="admin@gaga.com",
         name="Admin",
         surname="User"
     )
-    user = create_user(db_session, payload)
+    user = await create_user(db_session, payload, BackgroundTasks())
     assert user.id is not None
-    assert user.username == "admin"
     assert user.email == "admin@gaga.com"
+    assert user.email_verified is False
 
-    fetched = get_user(db_session, user.id)
-    assert fetched.username == "admin"
+    fetched = await get_user(db_session, user.id)
+    assert fetched.email == "admin@gaga.com"
+    assert fetched.hashed_password != "admin"  # la password non viene salvata in chiaro
+    assert fetched.verify_email_token is not None
 
 
-def test_create_user_multiple(db_session):
+@pytest.mark.anyio
+async def test_create_user_multiple(db_session):
     # Creazione di più utenti
     users_data = [
-        {"username": "user1", "hashed_password": "pass1", "email": "user1@gaga.com", "name": "U1", "surname": "S1"},
-        {"username": "user2", "hashed_password": "pass2", "email": "user2@gaga.com", "name": "U2", "surname": "S2"},
-        {"username": "user3", "hashed_password": "pass3", "email": "user3@gaga.com", "name": "U3", "surname": "S3"},
+        {"password": "pass1", "email": "user1@gaga.com", "name": "U1", "surname": "S1"},
+        {"password": "pass2", "email": "user2@gaga.com", "name": "U2", "surname": "S2"},
+        {"password": "pass3", "email": "user3@gaga.com", "name": "U3", "surname": "S3"},
     ]
     for data in users_data:
         payload = UserCreate(**data)
-        create_user(db_session, payload)
+        await create_user(db_session, payload, BackgroundTasks())
 
-    users = list_users(db_session)
+    users = await list_users(db_session)
     assert len(users) == 3
-    assert users[0].username == "user1"
-    assert users[2].email == "user3@gaga.com"
+    assert users[0]["name"] == "U1"
+    assert users[2]["email"] == "user3@gaga.com"
+    assert "hashed_password" not in users[0]
 
 
-def test_create_user_invalid_email(db_session):
+def test_create_user_invalid_email():
     with pytest.raises(ValidationError):
         UserCreate(
-            username="baduser",
-            hashed_password="pass",
+            password="pass",
             email="not-an-email",
             name="Bad",
             surname="User"
         )
 
 
-def test_create_user_missing_field(db_session):
+def test_create_user_missing_field():
     # Pydantic dovrebbe sollevare errore se manca un campo obbligatorio
     with pytest.raises(ValidationError):
         UserCreate(
-            username="incomplete",
-            hashed_password="pass",
+            password="pass",
             email="inc@gaga.com",
             name="Incomplete"
             # manca 'surname'
         )
 
 
-@pytest.mark.skip(reason="Se il DB ha vincolo UNIQUE su username, questo test verifica il fallimento")
-def test_create_user_duplicate_username(db_session):
+@pytest.mark.anyio
+async def test_create_user_duplicate_email(db_session):
     payload = UserCreate(
-        username="duplicate",
-        hashed_password="pass",
-        email="dup1@gaga.com",
+        password="pass",
+        email="dup@gaga.com",
         name="Dup",
         surname="One"
     )
-    create_user(db_session, payload)
+    await create_user(db_session, payload, BackgroundTasks())
 
     payload2 = UserCreate(
-        username="duplicate",
-        hashed_password="pass",
-        email="dup2@gaga.com",
+        password="pass",
+        email="dup@gaga.com",
         name="Dup",
         surname="Two"
     )
-    # qui dovrebbe fallire commit DB per violazione UNIQUE
-    with pytest.raises(Exception):
-        create_user(db_session, payload2)
+    # il vincolo UNIQUE su email fa fallire la INSERT
+    with pytest.raises(OrientatiException) as exc_info:
+        await create_user(db_session, payload2, BackgroundTasks())
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.details["type"] == "email_taken"
 
 
-def test_update_user_success(db_session):
+@pytest.mark.anyio
+async def test_update_user_success(db_session):
     # Create user first
     payload = UserCreate(
-        username="admin",
-        hashed_password="admin",
+        password="admin",
         email="gaga@gaga.com",
         name="gaga",
         surname="gagoso"
     )
-    user = create_user(db_session, payload)
+    user = await create_user(db_session, payload, BackgroundTasks())
 
     # Update user
     update_payload = UserUpdate(
-        username="superadmin",
+        name="supergaga",
         email="super@gaga.com"
     )
-    updated = update_user(db_session, user.id, update_payload)
+    updated = await update_user(db_session, user.id, update_payload, BackgroundTasks())
 
-    assert updated.username == "superadmin"
+    assert updated.name == "supergaga"
     assert updated.email == "super@gaga.com"
-    assert updated.name == "gaga"  # unchanged
     assert updated.surname == "gagoso"  # unchanged
 
 
+@pytest.mark.anyio
+async def test_update_user_already_in_session(db_session):
+    user = await create_user(db_session, UserCreate(password="pass", email="loaded@gaga.com", name="Old", surname="S"),
+                             BackgroundTasks())
+    # l'utente resta nell'identity map della session (come quando i background task lo referenziano)
+    db_user = await get_user(db_session, user.id)
+
+    updated = await update_user(db_session, user.id, UserUpdate(name="New"), BackgroundTasks())
+    assert updated.name == "New"
+    assert db_user.name == "New"
+
 
-def test_update_user_not_found(db_session):
-    update_payload = UserUpdate(username="ghost")
-    with pytest.raises(HttpClientException) as exc_info:
-        update_user(db_session, 9999, update_payload)
+@pytest.mark.anyio
+async def test_update_user_not_found(db_session):
+    update_payload = UserUpdate(name="ghost")
+    with pytest.raises(OrientatiException) as exc_info:
+        await update_user(db_session, 9999, update_payload, BackgroundTasks())
     assert exc_info.value.status_code == 404
 
-def test_list_users_pagination(db_session):
+
+@pytest.mark.anyio
+async def test_update_user_email_taken(db_session):
+    await create_user(db_session, UserCreate(password="pass", email="first@gaga.com", name="F", surname="F"),
+                      BackgroundTasks())
+    second = await create_user(db_session, UserCreate(password="pass", email="second@gaga.com", name="S", surname="S"),
+                               BackgroundTasks())
+
+    with pytest.raises(OrientatiException) as exc_info:
+        await update_user(db_session, second.id, UserUpdate(email="first@gaga.com"), BackgroundTasks())
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.details["type"] == "email_taken"
+
+    # la sessione è ancora utilizzabile dopo il rollback
+    assert (await get_user(db_session, second.id)).email == "second@gaga.com"
+
+
+@pytest.mark.anyio
+async def test_list_users_pagination(db_session):
     # Create multiple users
     for i in range(5):
         payload = UserCreate(
-            username=f"user{i}",
-            hashed_password="pass",
+            password="pass",
             email=f"user{i}@gaga.com",
             name=f"Name{i}",
             surname=f"Surname{i}"
         )
-        create_user(db_session, payload)
+        await create_user(db_session, payload, BackgroundTasks())
 
-    users = list_users(db_session, limit=3, offset=0)
+    users = await list_users(db_session, limit=3, offset=0)
     assert len(users) == 3
-    assert users[0].username == "user0"
+    assert users[0]["email"] == "user0@gaga.com"
 
-    users_page2 = list_users(db_session, limit=3, offset=3)
+    users_page2 = await list_users(db_session, limit=3, offset=3)
     assert len(users_page2) == 2  # restanti
 
 
-def test_change_password_success(db_session):
+@pytest.mark.anyio
+async def test_change_password_success(db_session):
     # Crea un utente
     payload = UserCreate(
-        username="pwuser",
-        hashed_password="oldpass",
+        password="oldpass",
         email="pwuser@gaga.com",
         name="Pw",
         surname="User"
     )
-    user = create_user(db_session, payload)
+    user = await create_user(db_session, payload, BackgroundTasks())
 
     # Cambia la password
     from app.schemas.user import ChangePasswordRequest
@@ -159,19 +193,24 @@ def test_change_password_success(db_session):
         old_password="oldpass",
         new_password="newpass"
     )
-    result = change_user_password(db_session, req.user_id, req.old_password, req.new_password)
+    result = await change_user_password(db_session, req.user_id, req.old_password, req.new_password,
+                                        BackgroundTasks())
+    assert result is True
+
+    # la nuova password è quella valida
+    result = await change_user_password(db_session, req.user_id, "newpass", "otherpass", BackgroundTasks())
     assert result is True
 
 
-def test_change_password_wrong_old_password(db_session):
+@pytest.mark.anyio
+async def test_change_password_wrong_old_password(db_session):
     payload = UserCreate(
-        username="pwuser2",
-        hashed_password="oldpass2",
+        password="oldpass2",
         email="pwuser2@gaga.com",
         name="Pw2",
         surname="User2"
     )
-    user = create_user(db_session, payload)
+    user = await create_user(db_session, payload, BackgroundTasks())
 
     from app.schemas.user import ChangePasswordRequest
     from app.services.user_service import change_user_password
@@ -181,11 +220,13 @@ def test_change_password_wrong_old_password(db_session):
         old_password="wrongpass",
         new_password="newpass"
     )
-    result = change_user_password(db_session, req.user_id, req.old_password, req.new_password)
+    result = await change_user_password(db_session, req.user_id, req.old_password, req.new_password,
+                                        BackgroundTasks())
     assert result is False
 
 
-def test_change_password_user_not_found(db_session):
+@pytest.mark.anyio
+async def test_change_password_user_not_found(db_session):
     from app.schemas.user import ChangePasswordRequest
     from app.services.user_service import change_user_password
 
@@ -194,28 +235,107 @@ def test_change_password_user_not_found(db_session):
         old_password="irrelevant",
         new_password="irrelevant"
     )
-    result = change_user_password(db_session, req.user_id, req.old_password, req.new_password)
+    result = await change_user_password(db_session, req.user_id, req.old_password, req.new_password,
+                                        BackgroundTasks())
     assert result is False
 
 
-def test_delete_user_success(db_session):
+@pytest.mark.anyio
+async def test_delete_user_success(db_session):
     # Crea un utente da eliminare
     payload = UserCreate(
-        username="todelete",
-        hashed_password="pass",
+        password="pass",
         email="todelete@gaga.com",
         name="To",
         surname="Delete"
     )
-    user = create_user(db_session, payload)
+    user = await create_user(db_session, payload, BackgroundTasks())
 
     from app.services.user_service import delete_user, get_user
-    result = delete_user(db_session, user.id)
+    result = await delete_user(db_session, user.id, BackgroundTasks())
     assert result is True
-    assert get_user(db_session, user.id) is None
+    assert await get_user(db_session, user.id) is None
 
 
-def test_delete_user_not_found(db_session):
+@pytest.mark.anyio
+async def test_delete_user_not_found(db_session):
     from app.services.user_service import delete_user
-    result = delete_user(db_session, 99999)
+    result = await delete_user(db_session, 99999, BackgroundTasks())
     assert result is False
+
+
+@pytest.mark.anyio
+async def test_verify_email_success(db_session):
+    user = await create_user(db_session, UserCreate(password="pass", email="verify@gaga.com", name="V", surname="U"),
+                             BackgroundTasks())
+    db_user = await get_user(db_session, user.id)
+
+    assert await verify_email(db_session, db_user.verify_email_token, BackgroundTasks()) is True
+
+    # l'utente già presente nella session viene aggiornato con i valori restituiti dall'UPDATE
+    assert db_user.email_verified is True
+    assert db_user.verify_email_token is None
+
+
+@pytest.mark.anyio
+async def test_verify_email_unknown_token(db_session):
+    with pytest.raises(OrientatiException) as exc_info:
+        await verify_email(db_session, "not-a-token", BackgroundTasks())
+    assert exc_info.value.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_verify_email_expired_token(db_session):
+    user = await create_user(db_session, UserCreate(password="pass", email="expired@gaga.com", name="E", surname="X"),
+                             BackgroundTasks())
+    db_user = await get_user(db_session, user.id)
+    db_user.verify_email_token_expiration = datetime.now(timezone.utc) - timedelta(minutes=1)
+    await db_session.commit()
+
+    with pytest.raises(OrientatiException) as exc_info:
+        await verify_email(db_session, db_user.verify_email_token, BackgroundTasks())
+    assert exc_info.value.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_get_user_if_none_match(db_session, client):
+    user = await create_user(db_session, UserCreate(password="pass", email="etag@gaga.com", name="E", surname="T"),
+                             BackgroundTasks())
+    url = f"/api/v1/users/{user.id}"
+
+    response = await client.get(url)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert etag.startswith('W/"')
+
+    for if_none_match in (etag, etag.removeprefix("W/"), f'W/"other", {etag}', "*"):
+        response = await client.get(url, headers={"If-None-Match": if_none_match})
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+        assert response.content == b""
+
+    response = await client.get(url, headers={"If-None-Match": 'W/"other"'})
+    assert response.status_code == 200
+    assert response.json()["email"] == "etag@gaga.com"
+
+
+@pytest.mark.anyio
+async def test_api_list_users_json(db_session, client):
+    for i in range(2):
+        await create_user(db_session, UserCreate(password="pass", email=f"list{i}@gaga.com", name=f"L{i}", surname="S"),
+                          BackgroundTasks())
+
+    response = await client.get("/api/v1/users/", params={"limit": 10})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    body = response.json()
+    assert [user["email"] for user in body] == ["list0@gaga.com", "list1@gaga.com"]
+    for user in body:
+        # solo i campi di UserOut: niente hashed_password né token di verifica
+        assert set(user) == {"id", "email", "email_verified", "name", "surname", "created_at", "updated_at"}
+        assert user["email_verified"] is False
+        # ISO 8601 come in UserOut (su SQLite i datetime tornano senza fuso orario)
+        for field in ("created_at", "updated_at"):
+            assert re.fullmatch(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:\d{2})?", user[field])
+        # stesso JSON di GET /users/{user_id}, che serializza UserOut
+        assert user == (await client.get(f"/api/v1/users/{user['id']}")).json()